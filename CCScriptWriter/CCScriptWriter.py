@@ -3,22 +3,20 @@
 # Extracts the dialogue from EarthBound and outputs it into a CCScript file.
 
 import argparse
-import array
-import math
+import bisect
 import os
 import re
 import sys
 import time
 
 import yaml
-from functools import reduce
 
 
 #############
 # CONSTANTS #
 #############
 
-D = [0x45, 0x41, 0x52, 0x54, 0x48, 0x20, 0x42, 0x4f, 0x55, 0x4E, 0x44]
+D = bytes([0x45, 0x41, 0x52, 0x54, 0x48, 0x20, 0x42, 0x4f, 0x55, 0x4E, 0x44])
 
 TEXT_DATA = [[0x50000, 0x51b12],    # SRE_POINTER_TABLE
              [0x51b12, 0x57fc1],    # TEXT_DATA (1)
@@ -39,28 +37,73 @@ TEXT_DATA = [[0x50000, 0x51b12],    # SRE_POINTER_TABLE
              [0x2f4e20, 0x2fa37a]]  # TEXT_DATA_EF4A40
 COMPRESSED_TEXT_PTRS = 0x8cded
 
-CONTROL_CODES = {0x00: 0, 0x01: 0, 0x02: 0, 0x03: 0, 0x04: 2, 0x05: 2, 0x06: 6,
-                 0x07: 2, 0x08: 4, 0x09: None, 0x0a: 4, 0x0b: 1, 0x0c: 1,
-                 0x0d: 1, 0x0e: 1, 0x0f: 0, 0x10: 1, 0x11: 0, 0x12: 0, 0x13: 0,
-                 0x14: 0, 0x15: 1, 0x16: 1, 0x17: 1, 0x18: None, 0x19: None,
-                 0x1a: None, 0x1b: None, 0x1c: None, 0x1d: None, 0x1e: None,
-                 0x1f: None, 0x20: 0, 0x21: 0, 0x22: 0, 0x23: 0, 0x24: 0,
-                 0x25: 0, 0x26: 0, 0x27: 0, 0x28: 0, 0x29: 0, 0x2a: 0, 0x2b: 0,
-                 0x2c: 0, 0x2d: 0, 0x2e: 0, 0x2f: 0, 0x30: 0}
-
-PATTERNS = [r"\[(06 \w\w \w\w )(\w\w \w\w \w\w \w\w)]",
+# Length of each control code's arguments, or -1 if it varies.
+CONTROL_CODES = [0, 0, 0, 0, 2, 2, 6, 2, 4, -1, 4, 1, 1, 1, 1, 0,        # 0x00
+                 1, 0, 0, 0, 0, 1, 1, 1, -1, -1, -1, -1, -1, -1, -1, -1, # 0x10
+                 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,         # 0x20
+                 0]                                                      # 0x30
+
+# Lengths of the variable-length control codes, by their first argument.
+COMBOS_1F = {0x00: 3, 0x01: 2, 0x02: 2, 0x03: 1, 0x04: 2, 0x05: 1,
+             0x06: 1, 0x07: 2, 0x11: 2, 0x12: 2, 0x13: 3, 0x14: 2,
+             0x15: 6, 0x16: 4, 0x17: 6, 0x18: 8, 0x19: 8, 0x1A: 4,
+             0x1B: 3, 0x1C: 3, 0x1D: 2, 0x1E: 4, 0x1F: 4, 0x20: 3,
+             0x21: 2, 0x23: 3, 0x30: 1, 0x31: 1, 0x41: 2, 0x50: 1,
+             0x51: 1, 0x52: 2, 0x60: 2, 0x61: 1, 0x62: 2, 0x63: 5,
+             0x64: 1, 0x65: 1, 0x66: 7, 0x67: 2, 0x68: 1, 0x69: 1,
+             0x71: 3, 0x81: 3, 0x83: 3, 0x90: 1, 0xA0: 1, 0xA1: 1,
+             0xA2: 1, 0xB0: 1, 0xC0: None, 0xD0: 2, 0xD1: 1, 0xD2: 2,
+             0xD3: 2, 0xE1: 4, 0xE4: 4, 0xE5: 2, 0xE6: 3, 0xE7: 3,
+             0xE8: 2, 0xE9: 3, 0xEA: 3, 0xEB: 3, 0xEC: 3, 0xED: 1,
+             0xEE: 3, 0xEF: 3, 0xF0: 1, 0xF1: 5, 0xF2: 5, 0xF3: 4,
+             0xF4: 3}
+COMBOS_18 = {0x00: 1, 0x01: 2, 0x02: 1, 0x03: 2, 0x04: 1, 0x05: 3,
+             0x06: 1, 0x07: 6, 0x08: 2, 0x09: 2, 0x0A: 1, 0x0D: 3}
+COMBOS_19 = {0x02: 1, 0x04: 1, 0x05: 4, 0x10: 2, 0x11: 2, 0x14: 1,
+             0x16: 3, 0x18: 2, 0x19: 3, 0x1A: 2, 0x1B: 2, 0x1C: 3,
+             0x1D: 3, 0x1E: 1, 0x1F: 1, 0x20: 1, 0x21: 2, 0x22: 5,
+             0x23: 6, 0x24: 6, 0x25: 2, 0x26: 2, 0x27: 2, 0x28: 2}
+COMBOS_1A = {0x00: 18, 0x01: 18, 0x04: 1, 0x05: 3, 0x06: 2, 0x07: 1,
+             0x08: 1, 0x09: 1, 0x0a: 1, 0x0B: 1}
+COMBOS_1C = {0x00: 2, 0x01: 2, 0x02: 2, 0x03: 2, 0x04: 1, 0x05: 2,
+             0x06: 2, 0x07: 2, 0x08: 2, 0x09: 1, 0x0A: 5, 0x0B: 5,
+             0x0C: 2, 0x0D: 1, 0x0E: 1, 0x0F: 1, 0x11: 2, 0x12: 2,
+             0x13: 3, 0x14: 2, 0x15: 2}
+COMBOS_1D = {0x00: 3, 0x01: 3, 0x02: 2, 0x03: 2, 0x04: 3, 0x05: 3,
+             0x06: 5, 0x07: 5, 0x08: 3, 0x09: 3, 0x0A: 2, 0x0B: 2,
+             0x0C: 3, 0x0D: 4, 0x0E: 3, 0x0F: 3, 0x10: 3, 0x11: 3,
+             0x12: 3, 0x13: 3, 0x14: 5, 0x15: 3, 0x17: 5, 0x18: 2,
+             0x19: 2, 0x20: 1, 0x21: 2, 0x22: 1, 0x23: 2, 0x24: 2}
+
+# Maps every byte to its character code; ordinary text is offset by 0x30.
+TEXT_TABLE = bytes((c - 0x30) & 0xff for c in range(0x100))
+# Matches any byte that isn't an ordinary character in a normal block.
+NOT_TEXT_RE = re.compile(rb"[\x00-\x30\x52\x8b-\x8d]")
+
+PATTERNS = [re.compile(p) for p in (
+            r"\[(06 \w\w \w\w )(\w\w \w\w \w\w \w\w)]",
             r"\[(08 )(\w\w \w\w \w\w \w\w)]",
             r"\[(09 \w\w)(( \w\w \w\w \w\w \w\w)+)\]",
             r"\[(0A )(\w\w \w\w \w\w \w\w)\]",
             r"\[(1A 0[0|1])(( \w\w \w\w \w\w \w\w)+)( \w\w)\]",
             r"\[(1B 0[2|3] )(\w\w \w\w \w\w \w\w)\]",
             r"\[(1F 63 )(\w\w \w\w \w\w \w\w)\]",
-            r"\[(1F C0 \w\w)(( \w\w \w\w \w\w \w\w)+)\]"]
+            r"\[(1F C0 \w\w)(( \w\w \w\w \w\w \w\w)+)\]")]
+COMBINED_PATTERNS = re.compile("|".join("(?P<p{}>{})".format(i, p.pattern)
+                                        for i, p in enumerate(PATTERNS)))
+PATTERN_GROUPS = {n: (g, g + PATTERNS[int(n[1:])].groups)
+                  for n, g in COMBINED_PATTERNS.groupindex.items()}
+COMPRESSED_RE = re.compile(r"\[(15|16|17) (\w\w)\]")
+EVENT_FLAG_RE = re.compile(r"Event Flag: (\d+)")
 REPLACE = [["[13][02]\"", "\" end"], ["[03][00]", "\" next\n\""],
            ["[00]", "\" linebreak\n\""], ["[01]", "\" newline\n\""],
-           ["[02]\"", "\" eob"], ["[0F]", "{inc}"], ["[0D 00]", "{rtoarg}"],
-           ["[0D 01]", "{ctoarg}"], ["[12]", "{clearline}"], ["[13]", "{wait}"],
-           ["[14]", "{prompt}"], ["[18 00]", "{window_closetop}"],
+           ["[02]\"", "\" eob"], ["[02][00]", "\" eob linebreak\n\""],
+           ["[02][01]", "\" eob newline\n\""],
+           ["[02][03][00]", "\" eob next\n\""],
+           ["[02][13][02]\"", "\" eob end"], ["[0F]", "{inc}"],
+           ["[0D 00]", "{rtoarg}"], ["[0D 01]", "{ctoarg}"],
+           ["[12]", "{clearline}"], ["[13]", "{wait}"], ["[14]", "{prompt}"],
+           ["[18 00]", "{window_closetop}"],
            ["[18 04]", "{window_closeall}"], ["[18 06]", "{window_clear}"],
            ["[18 0A]", "{open_wallet}"], ["[1B 00]", "{store_registers}"],
            ["[1B 01]", "{load_registers}"], ["[1B 04]", "{swap}"],
@@ -70,11 +113,15 @@ REPLACE = [["[13][02]\"", "\" end"], ["[03][00]", "\" next\n\""],
            ["[1F 01 02]", "{music_stop}"], ["[1F 03]", "{music_resume}"],
            ["[1F 05]", "{music_switching_off}"],
            ["[1F 06]", "{music_switching_on}"], ["[1F B0]", "{save}"],
-           ["[1F 30]", "{font_normal}"], ["[1F 31]", "{font_saturn}"],
-           [" \"\"", ""], [" \"\" ", " "], [" \"\"", ""], ["\"\" ", ""]]
-RE_REPLACE = [r"\[(0[4|5|7])( \w\w \w\w)\]",
+           ["[1F 30]", "{font_normal}"], ["[1F 31]", "{font_saturn}"]]
+REPLACE_MAP = dict(REPLACE)
+REPLACE_RE = re.compile("|".join(re.escape(k) for k in
+                                 sorted(REPLACE_MAP, key=len, reverse=True)))
+EMPTY_STRINGS = [[" \"\"", ""], [" \"\" ", " "], [" \"\"", ""], ["\"\" ", ""]]
+RE_REPLACE = [re.compile(p) for p in (
+              r"\[(0[4|5|7])( \w\w \w\w)\]",
               r"\[(10|18 01|18 03|0E|0B|0C])( \w\w)\]",
-              r"\[(1F 02|1F 00 00|1F 07])( \w\w)\]"]
+              r"\[(1F 02|1F 00 00|1F 07])( \w\w)\]")]
 
 COILSNAKE_FILES = ["attract_mode_txt.yml", "battle_action_table.yml",
                    "enemy_configuration_table.yml", "map_doors.yml",
@@ -93,6 +140,10 @@ SPECIAL_POINTERS = [0x49ea4, 0x49ea8, 0x49eac, 0x49eb0, 0x49eb4, 0x49eb8,
 
 ASM_POINTERS = [0x49dbd, 0x49dc9, 0x4f252]
 
+# Use the libyaml bindings when available; they are much faster.
+YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAMLDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 HEADER = """/*
  * EarthBound Text Dump
  * Time: {}
@@ -106,41 +157,45 @@ HEADER = """/*
 # UTILITY FUNCTIONS #
 #####################
 
-# Find the closest and lowest key.
-def FindClosest(dictionary, searchKey):
+# Find the closest lower and higher keys in a sorted list; higher is None if
+# there are no keys past searchKey.
+def FindClosest(keys, searchKey):
 
-    lower = 0
-    for key in sorted(dictionary):
-        if searchKey - key >= 0:
-            lower = key
-        else:
-            higher = key
+    k = bisect.bisect_right(keys, searchKey)
+    lower = keys[k - 1] if k else 0
+    higher = keys[k] if k < len(keys) else None
     return lower, higher
 
-# Format a hex number to a control code format.
-def FormatHex(intNum):
+# Reads a little-endian SNES address from the bytes at the given offsets.
+def ReadSNES(data, offsets):
 
-    hexNum = hex(intNum).lstrip("0x").upper()
-    if not hexNum:
-        hexNum = "00"
-    elif len(hexNum) == 1:
-        hexNum = "0{}".format(hexNum)
-    return hexNum
+    return sum(data[o] << (8 * k) for k, o in enumerate(offsets))
 
 # Converts an SNES address to a hexadecimal address.
 def FromSNES(snesNum):
 
-    if snesNum.count("0") == 8:
-        return 0
-    return int("".join(reversed(snesNum.strip().split())), 16)
+    return int("".join(snesNum.split()[::-1]), 16)
 
 # Converts a hexadecimal address to an SNES address.
 def ToSNES(hexNum):
 
-    if hexNum == 0:
-        return "00 00 00 00"
-    h = hex(hexNum).lstrip("0x").upper()
-    return " ".join(reversed(re.findall("\w\w", "{0:0>8}".format(h))))
+    return "{:02X} {:02X} {:02X} {:02X}".format(hexNum & 0xff,
+                                                (hexNum >> 8) & 0xff,
+                                                (hexNum >> 16) & 0xff,
+                                                (hexNum >> 24) & 0xff)
+
+# Loads a YAML file.
+def LoadYAML(fileName):
+
+    with open(fileName) as f:
+        return yaml.load(f, Loader=YAMLLoader)
+
+# Dumps data to YAML in the CoilSnake project's format.
+def DumpYAML(yamlData):
+
+    output = yaml.dump(yamlData, default_flow_style=False, Dumper=YAMLDumper)
+    return EVENT_FLAG_RE.sub(
+           lambda i: "Event Flag: " + hex(int(i.group(0)[12:])), output)
 
 
 ##################
@@ -154,24 +209,25 @@ class CCScriptWriter:
 
         # Declare our variables.
         self.asmPointers = {}
-        self.data = array.array("B")
+        self.data = bytearray()
         self.dialogue = {}
-        self.dataFiles = {}
+        self.labels = {}
         self.outputDirectory = outputDirectory
         self.pointers = []
         self.raw = raw
+        self.sortedBlocks = []
         self.specialPointers = {}
 
         # Get the data from the ROM file.
-        self.data.fromfile(romFile, int(os.path.getsize(romFile.name)))
+        self.data = bytearray(romFile.read())
+        romFile.close()
 
         # Check for a headered HiROM.
         try:
             if ~self.data[0x101dc] & 0xff == self.data[0x101de] \
               and ~self.data[0x101dd] & 0xff == self.data[0x101df] \
-              and self.data[0xffc0+0x200:0xffc0 + 0x200 + len(D)].tolist() == D:
+              and self.data[0xffc0 + 0x200:0xffc0 + 0x200 + len(D)] == D:
                 self.data = self.data[0x200:]
-            romFile.close()
         except IndexError:
             pass
 
@@ -179,12 +235,13 @@ class CCScriptWriter:
         try:
             if ~self.data[0x81dc] & 0xff == self.data[0x81de] \
               and ~self.data[0x81dd] & 0xff == self.data[0x81df] \
-              and self.data[0xffc0+0x200:0xffc0 + 0x200 + len(D)].tolist() == D:
+              and self.data[0x7fc0 + 0x200:0x7fc0 + 0x200 + len(D)] == D:
                 self.data = self.data[0x200:]
         except IndexError:
             pass
 
-        if self.data is None:
+        # Make sure the ROM's internal header is EarthBound's.
+        if self.data[0xffc0:0xffc0 + len(D)] != D:
             print("Invalid EarthBound ROM. Aborting.")
             sys.exit(1)
 
@@ -215,10 +272,9 @@ class CCScriptWriter:
                 print("Failed to open \"{}\". Invalid CoilSnake project. "
                       "Aborting.".format(project))
                 sys.exit(1)
-            for fileName in COILSNAKE_FILES:
-                csFile = open(os.path.join(o, fileName), "r")
-                yamlData = yaml.load(csFile, Loader=yaml.CSafeLoader)
-                csFile.close()
+            paths = [os.path.join(o, fileName) for fileName in COILSNAKE_FILES]
+            tables = [LoadYAML(path) for path in paths]
+            for fileName, yamlData in zip(COILSNAKE_FILES, tables):
                 if fileName != "map_doors.yml":
                     for e, v in yamlData.items():
                         for p in COILSNAKE_POINTERS:
@@ -247,94 +303,82 @@ class CCScriptWriter:
 
         # Find the special pointed-to locations.
         for p in SPECIAL_POINTERS:
-            address = ""
-            i = p
-            while i < p + 4:
-                address += " {}".format(FormatHex(self.data[i]))
-                i += 1
-            self.pointers.append(FromSNES(address))
+            self.pointers.append(ReadSNES(self.data, range(p, p + 4)))
 
         # Add new blocks as needed by the pointers.
         print("Checking pointers...")
-        pointers = [_f for _f in sorted(set(self.pointers)) if _f]
+        pointers = set(self.pointers)
+        pointers.discard(0)
+        pointers -= self.dialogue.keys()
         self.pointers = []
-        for address in self.dialogue:
-            if address in pointers:
-                pointers.remove(address)
-        for pointer in pointers:
-            try:
-                lower, higher = FindClosest(self.dialogue, pointer)
-            except UnboundLocalError:
+        blocks = sorted(self.dialogue)
+        for pointer in sorted(pointers):
+            lower, higher = FindClosest(blocks, pointer)
+            if higher is None:
                 continue
             block, i = self.getText(lower - 0xc00000, pointer - 0xc00000)
             self.dialogue[lower] = ["{}[0A {}]".format(block[0],
                                                        ToSNES(pointer)),
                                     block[1]]
             self.dialogue[pointer], i = self.getText(pointer - 0xc00000)
+            bisect.insort(blocks, pointer)
 
-        # Assign each group to its output file.
-        for k, block in enumerate(sorted(self.dialogue)):
-            self.dataFiles[block] = "data_{0:0>2}".format(k // 100)
+        # Assign each group to its output file and name its label.
+        self.sortedBlocks = blocks
+        for k, block in enumerate(self.sortedBlocks):
+            self.labels[block] = "data_{0:0>2}.l_{1}".format(k // 100,
+                                                             hex(block))
 
         # Add special pointer locations.
         for p in SPECIAL_POINTERS:
-            address = ""
-            i = p
-            while i < p + 4:
-                address += " {}".format(FormatHex(self.data[i]))
-                i += 1
-            address = FromSNES(address)
-            m = self.dataFiles[address]
-            h = hex(address)
-            self.specialPointers[p] = "[{{e({}.l_{})}}]".format(m, h)
+            address = ReadSNES(self.data, range(p, p + 4))
+            self.specialPointers[p] = "[{{e({})}}]".format(self.labels[address])
         for a in ASM_POINTERS:
             if self.data[a + 3] == 0x85:
-                address = FromSNES("{} {} {} {}".format(
-                                   FormatHex(self.data[a + 1]),
-                                   FormatHex(self.data[a + 2]),
-                                   FormatHex(self.data[a + 6]),
-                                   FormatHex(self.data[a + 7])))
+                address = ReadSNES(self.data, (a + 1, a + 2, a + 6, a + 7))
                 t = 0
             elif self.data[a + 3] == 0x8d:
-                address = FromSNES("{} {} {} {}".format(
-                                   FormatHex(self.data[a + 1]),
-                                   FormatHex(self.data[a + 2]),
-                                   FormatHex(self.data[a + 7]),
-                                   FormatHex(self.data[a + 8])))
+                address = ReadSNES(self.data, (a + 1, a + 2, a + 7, a + 8))
                 t = 1
-            m = self.dataFiles[address]
-            h = hex(address)
-            self.asmPointers[a] = ["{}.l_{}".format(m, h), t]
+            self.asmPointers[a] = [self.labels[address], t]
 
     # Performs various replacements on the dialogue blocks.
     def processDialogue(self):
 
         print("Processing dialogue...")
         f = self.replaceWithLabel
-        for block in self.dialogue:
-            b = self.dialogue[block][0]
-            b = "\"{}\"".format(b)
+        r = lambda matchObj: REPLACE_MAP[matchObj.group(0)]
+        for entry in self.dialogue.values():
+            b = entry[0]
 
             # Replace compressed text.
             if not self.raw:
-                b = re.sub(r"\[(15|16|17) (\w\w)\]", self.replaceCompressedText,
-                           b)
+                b = COMPRESSED_RE.sub(self.replaceCompressedText, b)
 
             # Replace all pointers with their label form.
-            for p in PATTERNS:
-                try:
-                    b = re.sub(p, f, b)
-                except (IndexError, KeyError):
-                    continue
+            try:
+                b = COMBINED_PATTERNS.sub(f, b)
+            except (IndexError, KeyError):
+                # Go one pattern at a time so that only the failing one is
+                # left unreplaced.
+                for p in PATTERNS:
+                    try:
+                        b = p.sub(f, b)
+                    except (IndexError, KeyError):
+                        continue
+
+            # Quote the text; the block endings below rely on the last quote.
+            b = "\"" + b + "\""
 
             # Replace control codes and more with CCScript syntax.
             if not self.raw:
-                for r in REPLACE:
-                    b = b.replace(r[0], r[1])
-                for r in RE_REPLACE:
-                    b = re.sub(r, self.replaceWithCCScript, b)
+                b = REPLACE_RE.sub(r, b)
+                for e in EMPTY_STRINGS:
+                    b = b.replace(e[0], e[1])
+                for p in RE_REPLACE:
+                    b = p.sub(self.replaceWithCCScript, b)
 
-            self.dialogue[block][0] = b
+            entry[0] = b
 
     # Outputs the processed dialogue to the specified output directory.
     def outputDialogue(self, outputCoilSnake=False):
@@ -345,9 +389,11 @@ class CCScriptWriter:
             os.makedirs(self.outputDirectory)
         o = self.outputDirectory
 
-        # Prepare the main file containing ROM addresses.
-        mainFile = open(os.path.join(o, "main.ccs"), "w")
-        m = mainFile.write
+        # Prepare the main file containing ROM addresses. Each file's contents
+        # are collected first and written out in one go, as UTF-8 with Unix
+        # line endings on every platform.
+        mainText = []
+        m = mainText.append
         m(HEADER)
         m("// DO NOT EDIT THIS FILE.\n")
         m("\ncommand e(label) \"{long label}\"")
@@ -355,30 +401,30 @@ class CCScriptWriter:
           "target\n    ROMTBL[loc, 7, 1] = short [1] target\n}")
 
         # Output each data_xx.ccs file.
-        numFiles = math.ceil(len(self.dialogue) / 100)
-        i = 0
-        while i <= numFiles:
-            f = "data_{0:0>2}.".format(i)
+        blocks = self.sortedBlocks
+        for i in range(0, len(blocks), 100):
+            f = "data_{0:0>2}.".format(i // 100)
             fileName = "{}ccs".format(f)
-            dataFile = open(os.path.join(o, fileName), "w")
-            d = dataFile.write
+            dataText = []
+            d = dataText.append
             d(HEADER)
             d("command e(label) \"{long label}\"\n")
             d("\n// Text Data\n")
-            dialogue = sorted(self.dialogue)[i * 100:i * 100 + 100]
+            dialogue = blocks[i:i + 100]
             m("\n\n// Memory Overwriting: {}".format(fileName))
             for block in dialogue:
-                d("l_{}:\n".format(hex(block)))
+                h = hex(block)
+                d("l_{}:\n".format(h))
                 lines = self.dialogue[block][0].split("\n")
                 for line in lines:
                     l = line.replace(f, "")
                     d("    {}\n".format(l))
                 d("\n")
                 if self.dialogue[block][1] >= 5:
-                    m("\nROM[{}] = goto({}l_{})".format(hex(block), f,
-                                                        hex(block)))
+                    m("\nROM[{}] = goto({})".format(h, self.labels[block]))
+            dataFile = open(os.path.join(o, fileName), "wb")
+            dataFile.write("".join(dataText).encode("utf-8"))
             dataFile.close()
-            i += 1
 
         # Take care of the special pointers (both SNES and ASM type).
         m("\n\n// Special Pointers")
@@ -389,6 +435,8 @@ class CCScriptWriter:
                 m("\n_asmptr({}, {})".format(hex(k + 0xc00000), p[0]))
             elif p[1] == 1:
                 m("\n_lasmptr({}, {})".format(hex(k + 0xc00000), p[0]))
+        mainFile = open(os.path.join(o, "main.ccs"), "wb")
+        mainFile.write("".join(mainText).encode("utf-8"))
         mainFile.close()
 
         # Optionally output to the CoilSnake project.
@@ -400,9 +448,9 @@ class CCScriptWriter:
 
         print("Modifying CoilSnake project...")
         o = os.path.join(self.outputDirectory, os.path.pardir)
-        for fileName in COILSNAKE_FILES:
-            csFile = open(os.path.join(o, fileName), "r")
-            yamlData = yaml.load(csFile, Loader=yaml.CSafeLoader)
+        paths = [os.path.join(o, fileName) for fileName in COILSNAKE_FILES]
+        tables = [LoadYAML(path) for path in paths]
+        for fileName, yamlData in zip(COILSNAKE_FILES, tables):
             if fileName != "map_doors.yml":
                 for e, v in yamlData.items():
                     pointers = {}
@@ -417,8 +465,7 @@ class CCScriptWriter:
                     if not pointers:
                         continue
                     for k, v in pointers.items():
-                        f = self.dataFiles[v]
-                        yamlData[e][k] = "{}.l_{}".format(f, hex(v))
+                        yamlData[e][k] = self.labels[v]
             else:
                 p = "Text Pointer"
                 for e, v in yamlData.items():
@@ -436,14 +483,12 @@ class CCScriptWriter:
                             if not pointers:
                                 continue
                             for a, b in pointers.items():
-                                f = self.dataFiles[b]
-                                yamlData[e][s][n][a] = "{}.l_{}".format(f,
-                                                                        hex(b))
-            csFile = open(os.path.join(o, fileName), "w")
-            output = yaml.dump(yamlData, default_flow_style=False,
-                      Dumper=yaml.CSafeDumper)
-            output = re.sub("Event Flag: (\d+)",
-                   lambda i: "Event Flag: " + hex(int(i.group(0)[12:])), output)
+                                yamlData[e][s][n][a] = self.labels[b]
+
+        # Write the modified files back.
+        outputs = [DumpYAML(yamlData) for yamlData in tables]
+        for path, output in zip(paths, outputs):
+            csFile = open(path, "w")
             csFile.write(output)
             csFile.close()
 
@@ -453,7 +498,9 @@ class CCScriptWriter:
     # block or a staff list block.
     def getText(self, i, stop=None, dataType=False):
 
-        block = ""
+        data = self.data
+        block = []
+        add = block.append
         start = i
         text = False
         normal_block_expect_02 = False
@@ -461,18 +508,16 @@ class CCScriptWriter:
         while True:
             if stop and stop == i:
                 break
-            c = self.data[i]
+            c = data[i]
             i += 1
             # Is it a normal block?
             if dataType == 0:
                 # Check if it's a control code.
                 if c <= 0x30:
-                    code = CONTROL_CODES[c]
-                    if isinstance(code, int):
-                        length = code
-                    else:
+                    length = CONTROL_CODES[c]
+                    if length < 0:
                         length = self.getLength(i)
-                    block += "[{}".format(FormatHex(c))
+                    add("[{:02X}".format(c))
 
                     # Mark if we expect an [02] before the end of the block
                     if c == 0x19:
@@ -481,9 +526,9 @@ class CCScriptWriter:
                     # Get the rest of the control code.
                     codeEnd = i + length
                     while i < codeEnd:
-                        block += " {}".format(FormatHex(self.data[i]))
+                        add(" {:02X}".format(data[i]))
                         i += 1
-                    block += "]"
+                    add("]")
 
                     # Stop if this is a block-ending character.
                     if c == 0x02 and normal_block_expect_02:
@@ -493,71 +538,77 @@ class CCScriptWriter:
                         break
                 # Check if it's a special character.
                 elif c == 0x52 or c == 0x8b or c == 0x8c or c == 0x8d:
-                    block += "[{}]".format(FormatHex(c))
-                # Looks like it's a normal character.
+                    add("[{:02X}]".format(c))
+                # Looks like it's a normal character; take the whole run of
+                # them at once.
                 else:
-                    block += chr(c - 0x30)
+                    m = NOT_TEXT_RE.search(data, i)
+                    end = m.start() if m else len(data)
+                    if stop and i <= stop < end:
+                        end = stop
+                    add(data[i - 1:end].translate(TEXT_TABLE).decode("latin1"))
+                    i = end
             elif dataType == 1:
                 # End of text block.
                 if c == 0x00:
-                    block += "[ 00 ]"
+                    add("[ 00 ]")
                     break
                 # Move the text over a distance noted by XX.
                 elif c == 0x01:
-                    block += "[ 01 {} ]".format(FormatHex(self.data[i]))
+                    add("[ 01 {:02X} ]".format(data[i]))
                     i += 1
                 # Move the text down a distance noted by XX.
                 elif c == 0x02:
-                    block += "[ 02 {} ]".format(FormatHex(self.data[i]))
+                    add("[ 02 {:02X} ]".format(data[i]))
                     i += 1
                 # Print the name of character XX (01 = Ness, XX[1,4]).
                 elif c == 0x08:
-                    block += "[ 08 {} ]".format(FormatHex(self.data[i]))
+                    add("[ 08 {:02X} ]".format(data[i]))
                     i += 1
                 # Drop down one line.
                 elif c == 0x09:
-                    block += "[ 09 ]"
+                    add("[ 09 ]")
                 # Looks like it's a normal character.
                 else:
-                    block += chr(c - 0x30)
+                    add(chr(c - 0x30))
             elif dataType == 2:
                 if c in (0x00, 0x01, 0x02, 0x04, 0xff):
                     if not text:
-                        block += "[ {} ]".format(FormatHex(c))
+                        add("[ {:02X} ]".format(c))
                     else:
-                        block += " ][ {} ]".format(FormatHex(c))
+                        add(" ][ {:02X} ]".format(c))
                         text = False
                 elif c == 0x03:
                     if not text:
-                        block += "[ 03 {} ]".format(FormatHex(self.data[i]))
+                        add("[ 03 {:02X} ]".format(data[i]))
                     else:
-                        block += " ][ 03 {} ]".format(FormatHex(self.data[i]))
+                        add(" ][ 03 {:02X} ]".format(data[i]))
                         text = False
                     i += 1
                 else:
                     if not text:
-                        block += "["
+                        add("[")
                         text = True
-                    block += " {}".format(FormatHex(c))
+                    add(" {:02X}".format(c))
                 if c == 0x00:
-                    block += "\"\n\""
+                    add("\"\n\"")
                 if c == 0xff:
                     break
 
+        block = "".join(block)
+
         # Check if it's referencing a location in memory.
         for pattern in PATTERNS:
-            matches = re.findall(pattern, block)
+            matches = pattern.findall(block)
             for match in matches:
                 pointer = match[1].strip()
                 if len(match) < 3:
                     self.pointers.append(FromSNES(pointer))
                 else:
                     p = pointer.split()
-                    idx = 0
-                    while idx < len(p):
-                        a = FromSNES(" ".join(map(str, p[idx:idx + 4])))
+                    for idx in range(0, len(p), 4):
+                        a = FromSNES(" ".join(p[idx:idx + 4]))
                         self.pointers.append(a)
-                        idx += 4
 
         return [block, i - start], i
 
@@ -578,46 +629,21 @@ class CCScriptWriter:
             else:
                 return 3
         elif c == 0x1F:
-            combos = {0x00: 3, 0x01: 2, 0x02: 2, 0x03: 1, 0x04: 2, 0x05: 1,
-                      0x06: 1, 0x07: 2, 0x11: 2, 0x12: 2, 0x13: 3, 0x14: 2,
-                      0x15: 6, 0x16: 4, 0x17: 6, 0x18: 8, 0x19: 8, 0x1A: 4,
-                      0x1B: 3, 0x1C: 3, 0x1D: 2, 0x1E: 4, 0x1F: 4, 0x20: 3,
-                      0x21: 2, 0x23: 3, 0x30: 1, 0x31: 1, 0x41: 2, 0x50: 1,
-                      0x51: 1, 0x52: 2, 0x60: 2, 0x61: 1, 0x62: 2, 0x63: 5,
-                      0x64: 1, 0x65: 1, 0x66: 7, 0x67: 2, 0x68: 1, 0x69: 1,
-                      0x71: 3, 0x81: 3, 0x83: 3, 0x90: 1, 0xA0: 1, 0xA1: 1,
-                      0xA2: 1, 0xB0: 1, 0xC0: None, 0xD0: 2, 0xD1: 1, 0xD2: 2,
-                      0xD3: 2, 0xE1: 4, 0xE4: 4, 0xE5: 2, 0xE6: 3, 0xE7: 3,
-                      0xE8: 2, 0xE9: 3, 0xEA: 3, 0xEB: 3, 0xEC: 3, 0xED: 1,
-                      0xEE: 3, 0xEF: 3, 0xF0: 1, 0xF1: 5, 0xF2: 5, 0xF3: 4,
-                      0xF4: 3}
             if self.data[i] != 0xC0:
-                return combos[self.data[i]]
+                return COMBOS_1F[self.data[i]]
             else:
                 numPointers = self.data[i + 1]
                 return 2 + numPointers * 4
         elif c == 0x18:
-            combos = {0x00: 1, 0x01: 2, 0x02: 1, 0x03: 2, 0x04: 1, 0x05: 3,
-                      0x06: 1, 0x07: 6, 0x08: 2, 0x09: 2, 0x0A: 1, 0x0D: 3}
+            combos = COMBOS_18
         elif c == 0x19:
-            combos = {0x02: 1, 0x04: 1, 0x05: 4, 0x10: 2, 0x11: 2, 0x14: 1,
-                      0x16: 3, 0x18: 2, 0x19: 3, 0x1A: 2, 0x1B: 2, 0x1C: 3,
-                      0x1D: 3, 0x1E: 1, 0x1F: 1, 0x20: 1, 0x21: 2, 0x22: 5,
-                      0x23: 6, 0x24: 6, 0x25: 2, 0x26: 2, 0x27: 2, 0x28: 2}
+            combos = COMBOS_19
         elif c == 0x1A:
-            combos = {0x00: 18, 0x01: 18, 0x04: 1, 0x05: 3, 0x06: 2, 0x07: 1,
-                      0x08: 1, 0x09: 1, 0x0a: 1, 0x0B: 1}
+            combos = COMBOS_1A
         elif c == 0x1C:
-            combos = {0x00: 2, 0x01: 2, 0x02: 2, 0x03: 2, 0x04: 1, 0x05: 2,
-                      0x06: 2, 0x07: 2, 0x08: 2, 0x09: 1, 0x0A: 5, 0x0B: 5,
-                      0x0C: 2, 0x0D: 1, 0x0E: 1, 0x0F: 1, 0x11: 2, 0x12: 2,
-                      0x13: 3, 0x14: 2, 0x15: 2}
+            combos = COMBOS_1C
         elif c == 0x1D:
-            combos = {0x00: 3, 0x01: 3, 0x02: 2, 0x03: 2, 0x04: 3, 0x05: 3,
-                      0x06: 5, 0x07: 5, 0x08: 3, 0x09: 3, 0x0A: 2, 0x0B: 2,
-                      0x0C: 3, 0x0D: 4, 0x0E: 3, 0x0F: 3, 0x10: 3, 0x11: 3,
-                      0x12: 3, 0x13: 3, 0x14: 5, 0x15: 3, 0x17: 5, 0x18: 2,
-                      0x19: 2, 0x20: 1, 0x21: 2, 0x22: 1, 0x23: 2, 0x24: 2}
+            combos = COMBOS_1D
         try:
             return combos[self.data[i]]
         except:
@@ -629,47 +655,41 @@ class CCScriptWriter:
         bank = int(matchObj.groups()[0], 16) - 0x15
         idx = int(matchObj.groups()[1], 16)
         p = COMPRESSED_TEXT_PTRS + (bank * 0x100 + idx) * 4
-        pointer = self.data[p:p + 4]
-        pointer.reverse()
-        pointer = int(reduce(lambda x, y: (x << 8) | y, pointer)) - 0xc00000
-        returnString = ""
-        while self.data[pointer] != 0:
-            returnString += chr(self.data[pointer] - 0x30)
-            pointer += 1
-        return returnString
+        pointer = int.from_bytes(self.data[p:p + 4], "little") - 0xc00000
+        end = self.data.index(0, pointer)
+        return self.data[pointer:end].translate(TEXT_TABLE).decode("latin1")
 
     # Replaces the control code's pointer(s) with labels instead.
     def replaceWithLabel(self, matchObj):
 
-        prefix = matchObj.groups()[0]
-        if len(matchObj.groups()) < 3:
-            pointer = matchObj.groups()[1]
+        groups = matchObj.groups()
+        if matchObj.lastgroup is not None:
+            start, end = PATTERN_GROUPS[matchObj.lastgroup]
+            groups = groups[start:end]
+        prefix = groups[0]
+        if len(groups) < 3:
+            pointer = groups[1]
             address = FromSNES(pointer)
             if not address:
                 return "[{}00 00 00 00]".format(prefix)
-            m = self.dataFiles[address]
-            h = hex(address)
+            label = self.labels[address]
             if prefix == "0A " and not self.raw:
-                return "\" goto({}.l_{}) \"".format(m, h)
+                return "\" goto({}) \"".format(label)
             elif prefix == "08 " and not self.raw:
-                return "\" call({}.l_{}) \"".format(m, h)
+                return "\" call({}) \"".format(label)
             else:
-                return "[{}{{e({}.l_{})}}]".format(prefix, m, h)
+                return "[{}{{e({})}}]".format(prefix, label)
         else:
-            pointers = matchObj.groups()[1].split()
+            pointers = groups[1].split()
             returnString = "[{}".format(prefix)
-            i = 0
-            while i < len(pointers):
-                address = FromSNES(" ".join(map(str, pointers[i:i + 4])))
+            for i in range(0, len(pointers), 4):
+                address = FromSNES(" ".join(pointers[i:i + 4]))
                 if address <= 0:
                     returnString += " 00 00 00 00"
                 else:
-                    returnString += " {{e({}.l_{})}}".format(
-                                                      self.dataFiles[address],
-                                                      hex(address))
-                i += 4
-            if len(matchObj.groups()) == 4:
-                returnString += matchObj.groups()[3]
+                    returnString += " {{e({})}}".format(self.labels[address])
+            if len(groups) == 4:
+                returnString += groups[3]
             returnString += "]"
             return returnString
 